@@ -1,6 +1,7 @@
 import os
-import json
+import orjson
 import logging
+import httpx
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -8,47 +9,107 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("DataInsightAgent")
 
+def _compact(obj, digits: int = 4):
+    """プロンプト用に浮動小数点を有効数字 digits 桁へ丸める (ネストにも再帰的に適用)"""
+    if isinstance(obj, float):
+        return float(f"{obj:.{digits}g}")
+    if isinstance(obj, dict):
+        return {k: _compact(v, digits) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_compact(v, digits) for v in obj]
+    return obj
+
 class DataInsightAgent:
     def __init__(self):
         self.api_key = os.getenv("AI_API_KEY")
         self.base_url = os.getenv("AI_BASE_URL", "https://api.deepseek.com")
         self.model_name = os.getenv("AI_MODEL_NAME", "deepseek-chat")
         self.client = None
+        # プロファイルの JSON 文字列を (パス, mtime) 単位でキャッシュ
+        self._cache = {}
         if self.api_key:
             try:
-                self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+                # HTTP/2 + 永続コネクションプールで LLM 呼び出しごとの接続確立を避ける
+                http_client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+                )
+                self.client = OpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
             except Exception as e:
                 logger.error(f"[!] AI連接失敗: {str(e)}")
 
+    def _load_profile_payload(self, profile_path: str) -> str:
+        """ファイルが更新されていなければ、前回シリアライズした文字列を再利用する"""
+        key = (profile_path, os.stat(profile_path).st_mtime)
+        # 複数スレッドから呼ばれるため、参照を 1 回だけ取得してから比較する
+        cache = self._cache
+        if cache.get('path') == key:
+            return cache['payload']
+        with open(profile_path, 'rb') as f:
+            profile_data = orjson.loads(f.read())
+        # 空白なし + 有効数字 4 桁に丸めて、プロンプトのトークン数を削減
+        payload = orjson.dumps(_compact(profile_data)).decode()
+        self._cache = {'path': key, 'payload': payload}
+        return payload
+
+    def _build_messages(self, profile_path: str, user_query: str) -> list:
+        system_prompt = f"""
+        You are a Senior GIS Expert. Analyze the metadata JSON and answer questions.
+        Metadata: {self._load_profile_payload(profile_path)}
+        """
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_query}
+        ]
+
+    @staticmethod
+    def _usage_dict(usage) -> dict:
+        # Token 使用統計
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens
+        }
+
     def generate_insight(self, profile_path: str, user_query: str) -> dict:
 
         if not self.client: return {"answer": "AI 未配置", "usage": {}}
 
         try:
-            with open(profile_path, 'r') as f:
-                profile_data = json.load(f)
-
-            system_prompt = f"""
-            You are a Senior GIS Expert. Analyze the metadata JSON and answer questions.
-            Metadata: {json.dumps(profile_data)}
-            """
             response = self.client.chat.completions.create(
                 model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_query}
-                ]
+                messages=self._build_messages(profile_path, user_query)
             )
-            
-            # Token 使用統計
-            usage = response.usage
             return {
                 "answer": response.choices[0].message.content,
-                "usage": {
-                    "prompt_tokens": usage.prompt_tokens,
-                    "completion_tokens": usage.completion_tokens,
-                    "total_tokens": usage.total_tokens
-                }
+                "usage": self._usage_dict(response.usage)
             }
         except Exception as e:
-            return {"answer": f"Error: {str(e)}", "usage": {}}
\ No newline at end of file
+            return {"answer": f"Error: {str(e)}", "usage": {}}
+
+    def generate_insight_stream(self, profile_path: str, user_query: str):
+        """回答を SSE (text/event-stream) 形式で逐次返すジェネレーター"""
+
+        def event(payload) -> bytes:
+            return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+        if not self.client:
+            yield event({"delta": "AI 未配置"})
+            yield b"data: [DONE]\n\n"
+            return
+
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=self._build_messages(profile_path, user_query),
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield event({"delta": chunk.choices[0].delta.content})
+                if chunk.usage:
+                    yield event({"usage": self._usage_dict(chunk.usage)})
+        except Exception as e:
+            yield event({"delta": f"Error: {str(e)}"})
+        yield b"data: [DONE]\n\n"
@@ -1,75 +1,216 @@
 import pandas as pd
 import numpy as np
-import json
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+import pyarrow.parquet as pq
+import orjson
+import math
 import os
-from sklearn.preprocessing import StandardScaler
+from types import MappingProxyType
+from numba import njit
+
+
+@njit(cache=True)
+def _scan_one_hot(bin_mat, n_wild):
+    """Wilderness + Soil の int8 行列を 1 パスで走査し、検証と折りたたみを同時に行う
+
+    API のワーカースレッドから呼ばれるため parallel は使わない
+    (Numba のスレッドレイヤーはスレッドセーフでない場合がある)
+    """
+    n, m = bin_mat.shape
+    wild_idx = np.empty(n, dtype=np.int8)
+    soil_idx = np.empty(n, dtype=np.int8)
+    n_invalid = 0
+    for i in range(n):
+        ws = 0
+        wi = 0
+        for j in range(n_wild):
+            v = bin_mat[i, j]
+            ws += v
+            if v:
+                wi = j
+        smax = -1
+        si = 0
+        for j in range(n_wild, m):
+            v = bin_mat[i, j]
+            if v > smax:
+                smax = v
+                si = j - n_wild
+        if ws != 1:
+            n_invalid += 1
+        wild_idx[i] = wi + 1
+        soil_idx[i] = si + 1
+    return wild_idx, soil_idx, n_invalid
+
 
 class ForestDataProcessor:
+    CONTINUOUS_COLS = (
+        'Elevation', 'Aspect', 'Slope', 
+        'Horizontal_Distance_To_Hydrology', 'Vertical_Distance_To_Hydrology',
+        'Horizontal_Distance_To_Roadways', 
+        'Hillshade_9am', 'Hillshade_Noon', 'Hillshade_3pm', 
+        'Horizontal_Distance_To_Fire_Points'
+    )
+    WILDERNESS_COLS = tuple(f'Wilderness_Area{i}' for i in range(1, 5))
+    SOIL_COLS = tuple(f'Soil_Type{i}' for i in range(1, 41))
+
+    # 読み込みスキーマ (import 時に 1 回だけ構築し、実行ごとの文字列→dtype 解決を省く)
+    DTYPE_MAP = MappingProxyType({
+        **{col: np.dtype(np.int8) for col in WILDERNESS_COLS + SOIL_COLS},
+        'Cover_Type': np.dtype(np.int8),
+        **{col: np.dtype(np.float32) for col in CONTINUOUS_COLS}
+    })
+    # CSV に存在しない列 (例: テストデータの Cover_Type) は PyArrow 側で無視される
+    ARROW_CONVERT_OPTIONS = pa_csv.ConvertOptions(
+        column_types={col: pa.from_numpy_dtype(dt) for col, dt in DTYPE_MAP.items()},
+        strings_can_be_null=True
+    )
+
     def __init__(self, raw_path: str):
         self.raw_path = raw_path
         self.df = None
-        self.scaler = StandardScaler()
+        self.soil_index = None
+        self.wilderness_index = None
+        self.scaler_mean = None
+        self.scaler_std = None
         
-        self.continuous_cols = [
-            'Elevation', 'Aspect', 'Slope', 
-            'Horizontal_Distance_To_Hydrology', 'Vertical_Distance_To_Hydrology',
-            'Horizontal_Distance_To_Roadways', 
-            'Hillshade_9am', 'Hillshade_Noon', 'Hillshade_3pm', 
-            'Horizontal_Distance_To_Fire_Points'
-        ]
-        
-        self.wilderness_cols = [f'Wilderness_Area{i}' for i in range(1, 5)]
-        self.soil_cols = [f'Soil_Type{i}' for i in range(1, 41)]
+        # pandas の列選択にはリストが必要なため、インスタンスごとにコピーして持つ
+        self.continuous_cols = list(self.CONTINUOUS_COLS)
+        self.wilderness_cols = list(self.WILDERNESS_COLS)
+        self.soil_cols = list(self.SOIL_COLS)
         self.binary_cols = self.wilderness_cols + self.soil_cols
 
     def load_and_optimize(self):
         print(f"[*] [Step 1] データの読み込み中: {self.raw_path} ...")
-        dtype_map = {col: 'int8' for col in self.binary_cols}
-        if 'Cover_Type' in pd.read_csv(self.raw_path, nrows=1).columns:
-            dtype_map['Cover_Type'] = 'int8'
-        for col in self.continuous_cols:
-            dtype_map[col] = 'float32'
-
-        self.df = pd.read_csv(self.raw_path, dtype=dtype_map)
+        # PyArrow のマルチスレッド CSV パーサで読み込み、境界で pandas に変換
+        table = pa_csv.read_csv(self.raw_path, convert_options=self.ARROW_CONVERT_OPTIONS)
+        # PyArrow は空セルを null として読み、int8 列は to_pandas で float64 に昇格してしまうため、
+        # 変換前に全列 (スキーマ外の列も含む) の欠損を拒否する
+        if any(col.null_count for col in table.columns):
+            raise ValueError("データに欠損値が含まれています")
+        self.df = table.to_pandas()
         print(f"    -> 行数: {len(self.df)}")
 
     def validate_integrity(self):
         print("[*] [Step 2] データの完全性を検証中...")
-        if self.df.isnull().sum().sum() > 0:
+        # null は読み込み時に拒否済み。int8 列は NaN を持てないため、連続変数のみ走査する
+        if np.isnan(self.df[self.continuous_cols].to_numpy()).any():
             raise ValueError("データに欠損値が含まれています")
+        # One-Hot 制約の検証と土壌・原生地域の折りたたみを 1 パスで実行
+        bin_mat = self.df[self.wilderness_cols + self.soil_cols].to_numpy(dtype=np.int8)
+        wild_idx, soil_idx, n_invalid = _scan_one_hot(bin_mat, len(self.wilderness_cols))
+        if n_invalid > 0:
+            raise ValueError(f"Wilderness_Area の One-Hot 制約に違反する行があります ({n_invalid} 行)")
+        self.wilderness_index, self.soil_index = wild_idx, soil_idx
         print("    -> 検証完了")
 
-    def process(self, output_parquet_path: str, output_profile_path: str):
+    def _collapse_one_hot_columns(self):
+        """44 列の One-Hot を Soil_Index (1..40) と Wilderness_Area (1..4) の 2 列に置き換える"""
+        self.df = self.df.drop(columns=self.binary_cols)
+        self.df['Soil_Index'] = self.soil_index
+        self.df['Wilderness_Area'] = self.wilderness_index
+
+    @staticmethod
+    def _mean_std(values: np.ndarray):
+        """sum と dot の 1 回ずつで平均と標本標準偏差 (ddof=1, pandas と同じ) を求める"""
+        v = values.astype(np.float64, copy=False)
+        n = v.size
+        mean = v.sum() / n
+        var = (np.dot(v, v) - n * mean * mean) / (n - 1)
+        return float(mean), math.sqrt(max(float(var), 0.0))
+
+    def _top_soil_distribution(self, idx: np.ndarray, k: int = 5) -> dict:
+        """bincount による頻度上位 k 件の土壌タイプ比率 (value_counts の代替)"""
+        counts = np.bincount(idx, minlength=len(self.soil_cols) + 1)
+        top = np.argpartition(counts, -k)[-k:]
+        top = top[np.argsort(-counts[top], kind='stable')]
+        total = counts.sum()
+        return {str(t): counts[t] / total for t in top if counts[t] > 0}
+
+    def _standardize_continuous(self):
+        """float32 のまま (x - mean) / std をインプレースで計算する (StandardScaler 相当)"""
+        X = self.df[self.continuous_cols].to_numpy(dtype=np.float32, copy=False)
+        if not X.flags.writeable:
+            X = X.copy()
+        mean = X.mean(axis=0, dtype=np.float32)
+        std = X.std(axis=0, dtype=np.float32)
+        np.subtract(X, mean, out=X)
+        np.divide(X, std, out=X, where=std != 0)
+        # df[cols] = X は列ごとに再ブロック化されるため、X をそのまま 1 つの float32 ブロックとして差し替える
+        columns = list(self.df.columns)
+        self.df = pd.concat(
+            [pd.DataFrame(X, columns=self.continuous_cols, index=self.df.index, copy=False),
+             self.df.drop(columns=self.continuous_cols)],
+            axis=1
+        )
+        if list(self.df.columns) != columns:
+            self.df = self.df[columns]
+        # 推論時に同じ変換を再現できるよう統計量を保持
+        self.scaler_mean, self.scaler_std = mean, std
+
+    def _write_parquet(self, sink):
+        """列ごとに圧縮・エンコーディングを調整して Parquet を書き出す (sink はパスまたは Arrow ストリーム)"""
+        table = pa.Table.from_pandas(self.df, preserve_index=False)
+        int_cols = [c for c in table.column_names if c not in self.continuous_cols]
+        float_cols = [c for c in self.continuous_cols if c in table.column_names]
+        pq.write_table(
+            table, sink,
+            compression={**{c: 'zstd' for c in int_cols}, **{c: 'snappy' for c in float_cols}},
+            use_dictionary=int_cols,
+            use_byte_stream_split=float_cols,
+            row_group_size=131072,
+            write_statistics=True,
+            data_page_version='2.0'
+        )
+
+    def to_parquet_buffer(self) -> pa.Buffer:
+        """Parquet をメモリ上に書き出す (ディスク書き込みと S3 アップロードを並行させるため)"""
+        sink = pa.BufferOutputStream()
+        self._write_parquet(sink)
+        return sink.getvalue()
+
+    @staticmethod
+    def write_profile(profile: dict, output_profile_path: str):
+        # OPT_SERIALIZE_NUMPY により NumPy スカラーをそのまま書き出せる
+        with open(output_profile_path, 'wb') as f:
+            f.write(orjson.dumps(profile, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+
+    def transform(self) -> dict:
+        """読み込みから標準化までを実行し、プロファイルを返す (永続化は行わない)"""
         self.load_and_optimize()
         self.validate_integrity()
 
         print("[*] [Step 3] 生成中")
         
         # 
-        raw_elevation_mean = float(self.df['Elevation'].mean())
-        raw_elevation_std = float(self.df['Elevation'].std())
+        raw_elevation_mean, raw_elevation_std = self._mean_std(self.df['Elevation'].to_numpy())
         
         # 土壌分布のトップ5を抽出
-        soil_series = self.df[self.soil_cols].idxmax(axis=1).apply(lambda x: int(x.replace('Soil_Type', '')))
-        soil_distribution = soil_series.value_counts(normalize=True).head(5).to_dict()
+        soil_distribution = self._top_soil_distribution(self.soil_index)
 
         profile = {
-            "dataset_rows": int(len(self.df)),
+            "dataset_rows": len(self.df),
             "elevation_mean": raw_elevation_mean, 
             "elevation_std": raw_elevation_std,
-            "top_5_soil_types": {str(k): float(v) for k, v in soil_distribution.items()}
+            "top_5_soil_types": soil_distribution
         }
 
+        # 折りたたみ済みのインデックスだけを残し、疎な One-Hot 列は保存しない
+        self._collapse_one_hot_columns()
+
         # 機械学習の前に、連続変数を標準化
         print("[*] [Step 4] 標準化中...")
-        self.df[self.continuous_cols] = self.scaler.fit_transform(self.df[self.continuous_cols])
+        self._standardize_continuous()
 
-        # --- 持久化 ---
-        self.df.to_parquet(output_parquet_path, index=False)
-        with open(output_profile_path, 'w') as f:
-            json.dump(profile, f, indent=4)
-        
         print(f"    -> [DONE] 平均値とる: {raw_elevation_mean:.2f} m")
+        return profile
+
+    def process(self, output_parquet_path: str, output_profile_path: str):
+        profile = self.transform()
+
+        # --- 持久化 ---
+        self._write_parquet(output_parquet_path)
+        self.write_profile(profile, output_profile_path)
 
 if __name__ == "__main__":
 
@@ -23,24 +23,20 @@ def generate_mock_dataset(filepath="forest_dataset.csv", num_rows=1000):
     }
 
     # 2. 生成 Wilderness_Area (4维，One-Hot 保证每行只有一个 1)
-    # 逻辑：随机生成 0-3 的索引，然后转为 One-Hot
-    wild_indices = np.random.randint(0, 4, num_rows)
-    wild_one_hot = np.eye(4)[wild_indices]
-    for i in range(4):
-        data[f'Wilderness_Area{i+1}'] = wild_one_hot[:, i].astype(int)
+    # 逻辑：随机生成 0-3 的索引，直接用 int8 单位矩阵取行得到 One-Hot
+    wild = np.eye(4, dtype=np.int8)[np.random.randint(0, 4, num_rows)]
 
     # 3. 生成 Soil_Type (40维，随机生成)
     # 为了测试简便，我们让大部分为 0，随机选一列为 1 (严格 One-Hot)
-    soil_indices = np.random.randint(0, 40, num_rows)
-    soil_one_hot = np.eye(40)[soil_indices]
-    for i in range(40):
-        data[f'Soil_Type{i+1}'] = soil_one_hot[:, i].astype(int)
+    soil = np.eye(40, dtype=np.int8)[np.random.randint(0, 40, num_rows)]
 
-    # 4. 生成 Label (Cover_Type 1-7)
-    data['Cover_Type'] = np.random.randint(1, 8, num_rows)
-
-    # 5. 构建 DataFrame 并保存
-    df = pd.DataFrame(data)
+    # 4. 生成 Label (Cover_Type 1-7)，并一次性构建 DataFrame
+    df = pd.DataFrame({
+        **data,
+        **{f'Wilderness_Area{i+1}': wild[:, i] for i in range(4)},
+        **{f'Soil_Type{i+1}': soil[:, i] for i in range(40)},
+        'Cover_Type': np.random.randint(1, 8, num_rows, dtype=np.int8)
+    })
     
     # 故意制造几个“极端值”来测试标准化效果 (可选)
     df.loc[0, 'Elevation'] = 3500 # 极高海拔
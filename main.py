@@ -1,10 +1,14 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from pydantic import BaseModel
-import shutil
 import os
-import json
-import glob
+import asyncio
+import threading
+import hashlib
+import tempfile
+from collections import OrderedDict, defaultdict
+from typing import Optional
+import pyarrow as pa
 from data_loader_v3 import ForestDataProcessor
 from s3_client_v2 import S3HybridClient
 from ai_agent import DataInsightAgent
@@ -17,35 +21,103 @@ os.makedirs(UPLOAD_DIR, exist_ok=True); os.makedirs(PROCESSED_DIR, exist_ok=True
 s3_uploader = S3HybridClient()
 ai_agent = DataInsightAgent()
 
+# 同一内容の CSV 再アップロード時に ETL を丸ごとスキップするための LRU キャッシュ
+# {(ファイル名, サイズ, blake2b): (parquet パス, profile パス, レスポンス)}
+# 出力パスはファイル名から決まるため、ファイル名もキーに含める
+ETL_CACHE_SIZE = 32
+etl_cache = OrderedDict()
+
+# 同じ出力ファイル ({stem}_cleaned.parquet / _profile.json) を書く /analyze を直列化するロック
+stem_locks = defaultdict(asyncio.Lock)
+
+# /chat が毎回ディレクトリを走査しないよう、最新プロファイルのパスを保持する
+LATEST_PROFILE: Optional[str] = None
+latest_profile_lock = threading.Lock()
+
 class ChatRequest(BaseModel):
     query: str
+    stream: bool = False
 
 @app.get("/")
 async def read_index(): return FileResponse("index.html")
 
+def _save_upload(src):
+    # 同名ファイルの同時アップロードが衝突しないよう、一意な一時ファイルに書き込む
+    # 1MB 単位でコピーしつつハッシュを計算し、ファイルの再読み込みを避ける (イベントループ外で実行)
+    h, size = hashlib.blake2b(), 0
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=".part", delete=False) as buffer:
+        while chunk := src.read(1 << 20):
+            buffer.write(chunk); h.update(chunk); size += len(chunk)
+    return buffer.name, size, h.hexdigest()
+
+def _evict_cache_entries(*paths: str):
+    # 上書きされる出力を指すエントリは、古い内容のレスポンスを返さないよう破棄する
+    for key in [k for k, v in etl_cache.items() if v[0] in paths or v[1] in paths]: del etl_cache[key]
+
+def _set_latest_profile(path: str):
+    global LATEST_PROFILE
+    with latest_profile_lock: LATEST_PROFILE = path
+
+def _get_latest_profile() -> Optional[str]:
+    global LATEST_PROFILE
+    with latest_profile_lock:
+        if LATEST_PROFILE is None:
+            # コールドスタート時のみ processed/ を 1 回走査する
+            with os.scandir(PROCESSED_DIR) as it:
+                entries = [e for e in it if e.is_file() and e.name.endswith("_profile.json")]
+            if entries: LATEST_PROFILE = max(entries, key=lambda e: e.stat().st_ctime).path
+        return LATEST_PROFILE
+
+def _persist_outputs(parquet_buf, parquet_path: str, profile: dict, profile_path: str):
+    with open(parquet_path, "wb") as f: f.write(parquet_buf)
+    ForestDataProcessor.write_profile(profile, profile_path)
+
 @app.post("/analyze")
 async def analyze_forest_data(file: UploadFile = File(...)):
     file_location = f"{UPLOAD_DIR}/{file.filename}"
+    tmp_location = None
     try:
-        with open(file_location, "wb") as buffer: shutil.copyfileobj(file.file, buffer)
+        tmp_location, size, digest = await asyncio.to_thread(_save_upload, file.file)
+        cache_key = (file.filename, size, digest)
         filename_no_ext = os.path.splitext(file.filename)[0]
         output_parquet = f"{PROCESSED_DIR}/{filename_no_ext}_cleaned.parquet"
         output_profile = f"{PROCESSED_DIR}/{filename_no_ext}_profile.json"
-        processor = ForestDataProcessor(raw_path=file_location)
-        processor.process(output_parquet_path=output_parquet, output_profile_path=output_profile)
-        upload_result = s3_uploader.upload_file(output_parquet)
-        with open(output_profile, "r") as f: profile_data = json.load(f)
-        return {"status": "success", "storage_info": upload_result, "ai_insight_source": profile_data}
+        # キャッシュ参照から登録までを同じロック内で行い、同じ出力を書く要求同士の競合を防ぐ
+        async with stem_locks[filename_no_ext]:
+            cached = etl_cache.get(cache_key)
+            if cached and os.path.exists(cached[0]) and os.path.exists(cached[1]):
+                etl_cache.move_to_end(cache_key)
+                _set_latest_profile(cached[1])
+                return cached[2]
+            _evict_cache_entries(output_parquet, output_profile)
+            processor = ForestDataProcessor(raw_path=tmp_location)
+            profile_data = await asyncio.to_thread(processor.transform)
+            parquet_buf = await asyncio.to_thread(processor.to_parquet_buffer)
+            # ローカル保存と S3 アップロードを同じバッファから並行実行
+            upload_result, _ = await asyncio.gather(
+                asyncio.to_thread(s3_uploader.upload_fileobj, pa.BufferReader(parquet_buf), os.path.basename(output_parquet)),
+                asyncio.to_thread(_persist_outputs, parquet_buf, output_parquet, profile_data, output_profile)
+            )
+            os.replace(tmp_location, file_location); tmp_location = None
+            _set_latest_profile(output_profile)
+            result = {"status": "success", "storage_info": upload_result, "ai_insight_source": profile_data}
+            if upload_result.get("status") == "success":
+                etl_cache[cache_key] = (output_parquet, output_profile, result)
+                if len(etl_cache) > ETL_CACHE_SIZE: etl_cache.popitem(last=False)
+        return result
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if tmp_location and os.path.exists(tmp_location): os.remove(tmp_location)
 
 @app.post("/chat")
 async def chat_with_data(request: ChatRequest):
     try:
-        list_of_files = glob.glob(f"{PROCESSED_DIR}/*_profile.json")
-        if not list_of_files: return JSONResponse(status_code=404, content={"message": "No data analyzed."})
-        latest_profile = max(list_of_files, key=os.path.getctime)
-        result = ai_agent.generate_insight(latest_profile, request.query)
-        return result 
+        latest_profile = _get_latest_profile()
+        if not latest_profile: return JSONResponse(status_code=404, content={"message": "No data analyzed."})
+        if request.stream:
+            return StreamingResponse(ai_agent.generate_insight_stream(latest_profile, request.query), media_type="text/event-stream")
+        result = await asyncio.to_thread(ai_agent.generate_insight, latest_profile, request.query)
+        return result
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
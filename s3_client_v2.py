@@ -1,6 +1,8 @@
 import boto3
 import os
 import logging
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, ClientError
 from dotenv import load_dotenv
 
@@ -20,6 +22,13 @@ class S3HybridClient:
         endpoint = os.getenv("AWS_ENDPOINT_URL") # AWS と MinIO の主な違い
 
         self.s3 = None
+        # 大きな Parquet はマルチパートで並列アップロードする
+        self.transfer_config = TransferConfig(
+            multipart_threshold=8 << 20,
+            multipart_chunksize=8 << 20,
+            max_concurrency=16,
+            use_threads=True
+        )
 
         if ak and sk:
             try:
@@ -30,7 +39,8 @@ class S3HybridClient:
                     aws_access_key_id=ak,
                     aws_secret_access_key=sk,
                     region_name=self.region,
-                    endpoint_url=endpoint 
+                    endpoint_url=endpoint,
+                    config=Config(tcp_keepalive=True, max_pool_connections=32)
                 )
                 logger.info(f"[*] S3 クライアントの初期化に成功しました (Endpoint: {endpoint if endpoint else 'AWS Cloud'})")
                 
@@ -61,20 +71,35 @@ class S3HybridClient:
 
         if self.s3:
             try:
-                self.s3.upload_file(file_path, self.bucket_name, object_name)
-                
-                # アクセスリンクを生成する（MinIO localhost に適合）
-                endpoint = os.getenv("AWS_ENDPOINT_URL")
-                if endpoint:
-                    url = f"{endpoint}/{self.bucket_name}/{object_name}"
-                else:
-                    url = f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{object_name}"
-                
-                logger.info(f"[+] アップロード成功: {url}")
-                return {"status": "success", "url": url, "provider": "MinIO" if endpoint else "AWS"}
+                self.s3.upload_file(file_path, self.bucket_name, object_name, Config=self.transfer_config)
+                return self._upload_success(object_name)
             except Exception as e:
                 logger.error(f"[-] アップロード異常: {str(e)}")
                 return {"status": "error", "detail": str(e)}
         else:
             # モックモード
-            return {"status": "success", "url": "mock://upload", "provider": "Mock"}
\ No newline at end of file
+            return {"status": "success", "url": "mock://upload", "provider": "Mock"}
+
+    def upload_fileobj(self, fileobj, object_name: str):
+        """メモリ上のバッファ等、ファイルライクオブジェクトを直接アップロードする"""
+        if self.s3:
+            try:
+                self.s3.upload_fileobj(fileobj, self.bucket_name, object_name, Config=self.transfer_config)
+                return self._upload_success(object_name)
+            except Exception as e:
+                logger.error(f"[-] アップロード異常: {str(e)}")
+                return {"status": "error", "detail": str(e)}
+        else:
+            # モックモード
+            return {"status": "success", "url": "mock://upload", "provider": "Mock"}
+
+    def _upload_success(self, object_name: str):
+        # アクセスリンクを生成する（MinIO localhost に適合）
+        endpoint = os.getenv("AWS_ENDPOINT_URL")
+        if endpoint:
+            url = f"{endpoint}/{self.bucket_name}/{object_name}"
+        else:
+            url = f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{object_name}"
+
+        logger.info(f"[+] アップロード成功: {url}")
+        return {"status": "success", "url": url, "provider": "MinIO" if endpoint else "AWS"}
\ No newline at end of file